@@ -21,7 +21,7 @@ security = HTTPBearer(auto_error=False)
 def hash_password(password: str) -> str:
     """哈希密码"""
     password_bytes = password.encode("utf-8")
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password_bytes, salt)
     return hashed.decode("utf-8")
 
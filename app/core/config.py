@@ -1,6 +1,7 @@
 """环境配置模块"""
 from functools import lru_cache
 
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -35,6 +36,9 @@ class Settings(BaseSettings):
     JWT_ALGORITHM: str = "HS256"
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24
 
+    # 密码哈希配置（bcrypt 计算量为 2^BCRYPT_ROUNDS，仅测试环境应调低；bcrypt 只接受 4~31）
+    BCRYPT_ROUNDS: int = Field(12, ge=4, le=31)
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
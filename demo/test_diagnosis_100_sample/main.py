@@ -1,19 +1,26 @@
+import csv
+import hashlib
 import os
-import re
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Any, cast
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Any, TextIO, cast
 from typing import Tuple, Optional
 
-import random
+import diskcache
+import httpx
+import numpy as np
 import openai
+import orjson
 import pandas as pd
+import re2
 from dotenv import load_dotenv
 from openai.types.chat import (
     ChatCompletionMessageParam,
     ChatCompletionUserMessageParam,
     ChatCompletionSystemMessageParam
 )
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter
 
 load_dotenv()
 
@@ -98,6 +105,9 @@ DIAGNOSIS_PROMPT_3 = """
 """
 
 
+MAX_WORKERS = 16
+
+
 class OpenAIChatCompletion:
     """
     OpenAI Chat Completion API的简单封装类
@@ -105,7 +115,7 @@ class OpenAIChatCompletion:
     用于方便地调用OpenAI的聊天完成API，支持自定义API密钥、基础URL和模型名称。
     """
 
-    def __init__(self, api_key: str, base_url: str, model_name: str):
+    def __init__(self, api_key: str, base_url: str, model_name: str, max_connections: int = MAX_WORKERS):
         """
         初始化OpenAI Chat Completion客户端
         
@@ -113,15 +123,24 @@ class OpenAIChatCompletion:
             api_key (str): OpenAI API密钥
             base_url (str): API基础URL
             model_name (str): 要使用的模型名称
+            max_connections (int): 连接池大小，应与并发线程数一致
         """
         self.api_key = api_key
         self.base_url = base_url
         self.model_name = model_name
 
-        # 初始化OpenAI客户端
+        # 初始化OpenAI客户端，多个线程共享同一个连接池，连接保持 keep-alive 以复用 TLS 握手
         self.client = openai.OpenAI(
             api_key=self.api_key,
-            base_url=self.base_url
+            base_url=self.base_url,
+            timeout=httpx.Timeout(600.0, connect=5.0),
+            http_client=openai.DefaultHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                    keepalive_expiry=60.0,
+                ),
+            ),
         )
 
     def chat(self, messages: List[ChatCompletionMessageParam],
@@ -235,7 +254,9 @@ class OpenAIChatCompletion:
         }
 
 
-ANSWER_RE = re.compile(r"<answer>\s*(.*?)\s*</answer>", re.DOTALL | re.IGNORECASE)
+# RE2 基于 DFA，匹配时间与输入长度线性相关，模型输出缺少 </answer> 时也不会反复回溯
+# (?is) 等价于 re.DOTALL | re.IGNORECASE
+ANSWER_RE = re2.compile(r"(?is)<answer>\s*(.*?)\s*</answer>")
 
 
 def extract_answer(text: str) -> str:
@@ -251,6 +272,18 @@ PROMPTS = {
     "p3": DIAGNOSIS_PROMPT_3,
 }
 
+
+def group_prompt_keys(prompts: Dict[str, str]) -> List[Tuple[str, ...]]:
+    """把模板完全相同的 prompt key 分为一组，同组只需一次 n=len(group) 的请求，服务端只需编码一次 prompt"""
+    groups: Dict[str, List[str]] = {}
+    for k, template in prompts.items():
+        groups.setdefault(template, []).append(k)
+    return [tuple(keys) for keys in groups.values()]
+
+
+# p1 与 p2 模板相同 -> [("p1", "p2"), ("p3",)]
+PROMPT_GROUPS = group_prompt_keys(PROMPTS)
+
 def build_prompt(template: str, basic_info: str, chief_complaint: str, present_illness: str, four_diagnosis: str) -> str:
     medical_record = (
         f"基本信息（脱敏）: {basic_info}\n"
@@ -264,88 +297,516 @@ def build_prompt(template: str, basic_info: str, chief_complaint: str, present_i
     )
 
 
+def check_output(content: str, finish_reason: Optional[str]) -> Tuple[str, Optional[str]]:
+    """
+    校验模型输出是否完整
+    返回: (answer, error)，error 为 None 表示输出有效
+    """
+    answer = extract_answer(content)
+
+    has_open_answer = "<answer" in content.lower()
+    has_close_answer = "</answer>" in content.lower()
+    answer_tag_incomplete = has_open_answer and (not has_close_answer)
+
+    # 成功条件：必须抽到 answer，并且不是 length 截断，并且标签不是不完整
+    if answer and (finish_reason != "length") and (not answer_tag_incomplete):
+        return answer, None
+
+    return answer, (
+        "incomplete_output("
+        f"answer_empty={not bool(answer)}, "
+        f"answer_tag_incomplete={answer_tag_incomplete}, "
+        f"finish_reason={finish_reason}"
+        ")"
+    )
+
+
+class IncompleteOutputError(Exception):
+    """模型输出不完整（未抽到 answer、被截断或标签不完整），需要重试"""
+
+
+MAX_RETRIES = 3
+
+# 调整 prompt 时会反复运行本脚本，未改动的 prompt 直接从磁盘缓存取结果
+LLM_CACHE_DIR = "./.llm_cache"
+
+# 提示词要求先在 <think> 中完整推理再给出 <answer>，推理长度没有限制，需要留足余量：
+# 被截断（finish_reason=length）的输出会整次重试，比多预留的 token 代价更高。
+# 按 output.xlsx / output_comparison.xlsx 中 400 次调用的 completion_tokens：
+# p50=728，p90=1017，p99=1290，最大 1546，上限取最大值的约 2 倍
+MAX_TOKENS = 3072
+
+
+# 服务商明确拒绝 n 参数后置位，此后同组的 key 改为逐个请求（多线程共享）
+N_UNSUPPORTED = threading.Event()
+# 错误信息中指向 n 参数的写法，如 "'n' is not supported"、"Unsupported parameter: n"、
+# "n not supported"、"n must be 1"、"only n=1 is allowed"
+N_PARAM_RE = re2.compile(
+    r"""(?i)['"`]n['"`]|\bparam(?:eter)?s?\s*:?\s*n\b|(?:^|[\s:'"`])n\s+(?:is\s+)?(?:not|must|should)\b|\bn\s*=\s*\d"""
+)
+
+
+def rejects_n_param(e: Exception) -> bool:
+    """
+    判断 4xx 错误是否由 n 参数本身引起
+    上下文超长、内容审核等只与这一行有关的 400/422 不能关闭整个运行的合并采样
+    """
+    if not isinstance(e, (openai.BadRequestError, openai.UnprocessableEntityError)):
+        return False
+    if getattr(e, "param", None) == "n":
+        return True
+    return N_PARAM_RE.search(str(getattr(e, "message", "") or e)) is not None
+
+
+def apply_choice(meta: Dict[str, Any], choice: Any) -> None:
+    """校验一个 choice 的输出并记录到 meta，输出完整时写入 meta["answer"]"""
+    content = choice.message.content or ""
+    meta["last_finish_reason"] = getattr(choice, "finish_reason", None)
+    meta["last_raw"] = content
+
+    answer, meta["error"] = check_output(content, meta["last_finish_reason"])
+    if meta["error"] is None:
+        meta["answer"] = answer
+
+
+def usage_tuple(response: Any) -> Optional[Tuple[int, int, int]]:
+    """(prompt_tokens, completion_tokens, total_tokens)，服务商未返回 usage 时为 None"""
+    usage = getattr(response, "usage", None)
+    return (usage.prompt_tokens, usage.completion_tokens, usage.total_tokens) if usage else None
+
+
+def request_group(
+    llm: "OpenAIChatCompletion",
+    prompt: str,
+    temperature: float,
+    max_tokens: int,
+    metas: Dict[str, Dict[str, Any]],
+    pending: List[str],
+) -> None:
+    """为 pending 中的 key 发送一次 n=len(pending) 的请求，第 i 个 choice 对应第 i 个 key"""
+    t0 = time.perf_counter()
+    try:
+        response = llm.chat(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            n=len(pending),
+        )
+    except Exception as e:
+        dt = time.perf_counter() - t0
+        for k in pending:
+            metas[k]["last_attempt_seconds"] = dt
+            metas[k]["error"] = f"{type(e).__name__}: {e}"
+        # 部分兼容 OpenAI 接口的服务商不支持 n 参数并直接报错，之后的重试和其余行都改为逐个请求；
+        # 其他 4xx 只按这一行的错误交给 tenacity 重试
+        if rejects_n_param(e):
+            N_UNSUPPORTED.set()
+        raise
+
+    dt = time.perf_counter() - t0
+
+    for k in pending:
+        metas[k]["last_attempt_seconds"] = dt
+        metas[k]["last_usage"] = None
+        # 服务商忽略 n 时返回的 choice 少于 key 数量，缺少的 key 留到下一次重试
+        metas[k]["error"] = "missing_choice"
+    # usage 是整次请求（所有 choice 合计）的 token 数，只记在第一个 key 上，按列求和时不会重复计算
+    metas[pending[0]]["last_usage"] = usage_tuple(response)
+
+    for k, choice in zip(pending, response.choices):
+        apply_choice(metas[k], choice)
+
+
+def request_single(
+    llm: "OpenAIChatCompletion",
+    prompt: str,
+    temperature: float,
+    max_tokens: int,
+    meta: Dict[str, Any],
+) -> None:
+    """为单个 key 发送一次不带 n 参数的请求"""
+    t0 = time.perf_counter()
+    try:
+        response = llm.chat(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+    except Exception as e:
+        meta["last_attempt_seconds"] = time.perf_counter() - t0
+        meta["error"] = f"{type(e).__name__}: {e}"
+        raise
+
+    meta["last_attempt_seconds"] = time.perf_counter() - t0
+    meta["last_usage"] = usage_tuple(response)
+    apply_choice(meta, response.choices[0])
+
+
+@retry(
+    stop=stop_after_attempt(MAX_RETRIES + 1),
+    wait=wait_exponential_jitter(initial=0.8, max=10),
+    reraise=True,
+)
+def request_diagnosis(
+    llm: "OpenAIChatCompletion",
+    prompt: str,
+    temperature: float,
+    max_tokens: int,
+    metas: Dict[str, Dict[str, Any]],
+) -> None:
+    """
+    为共用同一 prompt 的一组 key 请求诊断，只为尚未成功的 key 采样
+    服务商支持 n 参数时合并为一次 n=len(pending) 的请求，否则逐个 key 请求
+    成功的 key 把 answer 记录在各自的 meta 中；仍有 key 输出不完整时抛出 IncompleteOutputError 交给 tenacity 重试
+    每次尝试的信息都记录在各自的 meta 中
+    """
+    pending = [k for k, meta in metas.items() if "answer" not in meta]
+    for k in pending:
+        metas[k]["attempts"] += 1
+
+    if len(pending) > 1 and not N_UNSUPPORTED.is_set():
+        request_group(llm, prompt, temperature, max_tokens, metas, pending)
+    else:
+        errors = []
+        for k in pending:
+            try:
+                request_single(llm, prompt, temperature, max_tokens, metas[k])
+            except Exception as e:
+                # 一个 key 的请求失败不影响同组其他 key，错误已记录在 meta 中
+                errors.append(e)
+        if errors and len(errors) == len(pending):
+            raise errors[0]
+
+    incomplete = [k for k in pending if "answer" not in metas[k]]
+    if incomplete:
+        raise IncompleteOutputError("; ".join(f"{k}: {metas[k]['error']}" for k in incomplete))
+
+
+def zero_cost_meta(meta: Dict[str, Any], **marker: Any) -> Dict[str, Any]:
+    """
+    复制 meta 并把尝试次数、耗时和 token 数清零，再附加来源标记（cached / dedup_of）
+    用于结果不是本次运行为该行调用大模型得到的情况：命中缓存，或复用了输入相同的另一行的结果，
+    这样对结果表的耗时和 token 求和时每次实际调用只计一次
+    """
+    return {
+        **meta,
+        "attempts": 0,
+        "total_seconds": 0.0,
+        "last_attempt_seconds": 0.0,
+        "last_usage": None,
+        **marker,
+    }
+
+
 def tcm_diagnosis(
     llm: "OpenAIChatCompletion",
-    prompt_key: str,
+    prompt_keys: Tuple[str, ...],
     basic_info: str,
     chief_complaint: str,
     present_illness: str,
     four_diagnosis: str,
     temperature: float = 0.2,
-    max_tokens: int = 8096,
-    max_retries: int = 3,
-) -> Tuple[str, str, Dict[str, Any]]:
+    max_tokens: int = MAX_TOKENS,
+    cache: Optional[diskcache.Cache] = None,
+) -> Dict[str, Tuple[str, str, Dict[str, Any]]]:
     """
-    返回: (answer, raw_output, meta)
-    meta 包含: attempts, total_seconds, last_finish_reason, last_usage, error
+    prompt_keys 为模板相同的一组 prompt key（见 PROMPT_GROUPS），共用一次 n=len(prompt_keys) 的请求
+    返回: {prompt_key: (answer, raw_output, meta)}
+    meta 包含: attempts, total_seconds, last_finish_reason, last_usage, error, cached
+    last_usage 为 (prompt_tokens, completion_tokens, total_tokens)；合并请求的 usage 只记在组内第一个 key 上
+    传入 cache 时，成功的结果按 (prompt_key, prompt 哈希, 模型, 采样参数) 缓存到磁盘，重复运行时直接返回；
+    命中缓存的 meta 标记 cached=True，尝试次数、耗时和 token 数清零，本次运行没有产生这些开销
     """
-    template = PROMPTS[prompt_key]
+    template = PROMPTS[prompt_keys[0]]
     prompt = build_prompt(template, basic_info, chief_complaint, present_illness, four_diagnosis)
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    results: Dict[str, Tuple[str, str, Dict[str, Any]]] = {}
+    metas: Dict[str, Dict[str, Any]] = {}
+
+    for k in prompt_keys:
+        hit = cache.get((k, prompt_hash, llm.model_name, temperature, max_tokens)) if cache is not None else None
+        if hit is not None:
+            answer, content, cached_meta = hit
+            results[k] = (answer, content, zero_cost_meta(cached_meta, cached=True))
+            continue
+
+        metas[k] = {
+            "attempts": 0,
+            "total_seconds": 0.0,
+            "last_finish_reason": None,
+            "last_usage": None,
+            "error": None,
+            "cached": False,
+        }
+
+    if not metas:
+        return results
+
+    start_total = time.perf_counter()
+    try:
+        request_diagnosis(llm, prompt, temperature, max_tokens, metas)
+    except Exception:
+        # 重试次数用尽，错误信息已记录在各自的 meta["error"] 中
+        pass
+    total_seconds = time.perf_counter() - start_total
 
+    for k, meta in metas.items():
+        answer = meta.pop("answer", "")
+        content = meta.pop("last_raw", "")
+        meta["total_seconds"] = total_seconds
+        results[k] = (answer, content, meta)
+
+        if cache is not None and meta["error"] is None:
+            cache.set((k, prompt_hash, llm.model_name, temperature, max_tokens), results[k])
+    return results
+
+
+# 构造 prompt 需要的输入列，顺序与 build_prompt 的参数一致
+INPUT_COLUMNS = ["基本信息（脱敏）", "主诉", "现病史", "四诊信息"]
+
+
+def read_input(path: str) -> pd.DataFrame:
+    """
+    读取输入表格
+    使用 calamine（Rust 实现）解析 xlsx，输入列直接读为字符串并把空单元格填成 ""，
+    其余列（病历编号、人工辨证结果等）原样保留以便写入对比结果；
+    表格缺少的输入列按空字符串补齐（与逐行 row.get(col, "") 的行为一致），并打印缺少的列名
+    """
+    df = pd.read_excel(path, engine="calamine", dtype={col: str for col in INPUT_COLUMNS})
+    missing = [col for col in INPUT_COLUMNS if col not in df.columns]
+    if missing:
+        print(f"输入表格缺少列 {missing}，按空字符串处理")
+    df = df.reindex(columns=[*df.columns, *missing], fill_value="")
+    df[INPUT_COLUMNS] = df[INPUT_COLUMNS].fillna("")
+    return df
+
+
+def read_row(row: pd.Series) -> Tuple[str, str, str, str]:
+    """读取一行病历: (基本信息, 主诉, 现病史, 四诊信息)"""
+    return row["基本信息（脱敏）"], row["主诉"], row["现病史"], row["四诊信息"]
+
+
+def input_key(fields: Tuple[str, str, str, str]) -> bytes:
+    """病历输入的指纹，输入完全相同的行只需调用一次大模型"""
+    return hashlib.blake2b("\x1f".join(fields).encode("utf-8"), digest_size=16).digest()
+
+
+def init_result_columns(df: pd.DataFrame) -> None:
+    """预分配结果列：数值列使用定长 ndarray，字符串列一次性分配"""
+    n = len(df)
+    for k in PROMPTS.keys():
+        df[f"中医辩证_{k}"] = [""] * n
+        df[f"大模型输出_{k}"] = [""] * n
+        df[f"尝试次数_{k}"] = np.zeros(n, dtype=np.int32)
+        df[f"总耗时秒_{k}"] = np.zeros(n, dtype=np.float32)
+        df[f"最后一次耗时秒_{k}"] = np.zeros(n, dtype=np.float32)
+        df[f"finish_reason_{k}"] = [""] * n
+        df[f"prompt_tokens_{k}"] = np.zeros(n, dtype=np.int32)
+        df[f"completion_tokens_{k}"] = np.zeros(n, dtype=np.int32)
+        df[f"total_tokens_{k}"] = np.zeros(n, dtype=np.int32)
+        df[f"error_{k}"] = [""] * n
+        df[f"缓存命中_{k}"] = np.zeros(n, dtype=bool)
+        df[f"去重来源_{k}"] = [""] * n
+
+
+def write_result(df: pd.DataFrame, idx: Any, k: str, answer: str, raw: str, meta: Dict[str, Any]) -> None:
+    """把一次诊断结果写回 DataFrame 对应的单元格"""
+    df.at[idx, f"中医辩证_{k}"] = answer
+    df.at[idx, f"大模型输出_{k}"] = raw
+    df.at[idx, f"尝试次数_{k}"] = meta.get("attempts", 0)
+    df.at[idx, f"总耗时秒_{k}"] = float(meta.get("total_seconds", 0.0) or 0.0)
+    df.at[idx, f"最后一次耗时秒_{k}"] = float(meta.get("last_attempt_seconds", 0.0) or 0.0)
+    df.at[idx, f"finish_reason_{k}"] = str(meta.get("last_finish_reason", "") or "")
+    prompt_tokens, completion_tokens, total_tokens = meta.get("last_usage") or (0, 0, 0)
+    df.at[idx, f"prompt_tokens_{k}"] = prompt_tokens
+    df.at[idx, f"completion_tokens_{k}"] = completion_tokens
+    df.at[idx, f"total_tokens_{k}"] = total_tokens
+    df.at[idx, f"error_{k}"] = str(meta.get("error", "") or "")
+    df.at[idx, f"缓存命中_{k}"] = bool(meta.get("cached", False))
+    df.at[idx, f"去重来源_{k}"] = dedup_label(meta)
+
+
+def dedup_label(meta: Dict[str, Any]) -> str:
+    """复用了其他行结果时返回来源行号，否则返回空串"""
+    dedup_of = meta.get("dedup_of")
+    return "" if dedup_of is None else str(dedup_of)
+
+
+# 每完成一个任务就向该文件追加结果行，程序中途崩溃时已完成的结果不会丢失
+PROGRESS_CSV_FILE = "./output_progress.csv"
+PROGRESS_CSV_HEADER = ["行号", "prompt", "中医辩证", "大模型输出", "尝试次数", "总耗时秒", "finish_reason", "error", "缓存命中", "去重来源"]
+
+
+def append_progress(progress: TextIO, idx: Any, k: str, answer: str, raw: str, meta: Dict[str, Any]) -> None:
+    """向进度 CSV 追加一行结果并立即刷盘"""
+    csv.writer(progress).writerow([
+        idx,
+        k,
+        answer,
+        raw,
+        meta.get("attempts", 0),
+        float(meta.get("total_seconds", 0.0) or 0.0),
+        str(meta.get("last_finish_reason", "") or ""),
+        str(meta.get("error", "") or ""),
+        bool(meta.get("cached", False)),
+        dedup_label(meta),
+    ])
+    progress.flush()
+
+
+def make_done_callback(
+    df: pd.DataFrame,
+    lock: threading.Lock,
+    idx: Any,
+    prompt_keys: Tuple[str, ...],
+    progress: Optional[TextIO] = None,
+    dedup_of: Any = None,
+):
+    """
+    生成 Future 完成回调：任务一结束就把结果写回 DataFrame（并追加到进度 CSV），无需再遍历 futures
+    dedup_of 为实际发出请求的行号：该行只复用结果，开销已记在来源行上，写入时清零
+    """
+
+    def _cb(fut: Future) -> None:
+        try:
+            results = fut.result()
+        except Exception as e:
+            meta = {
+                "attempts": 0, "total_seconds": 0.0, "last_attempt_seconds": 0.0,
+                "last_finish_reason": "", "last_usage": None,
+                "error": f"{type(e).__name__}: {e}"
+            }
+            results = {k: ("", "", meta) for k in prompt_keys}
+
+        if dedup_of is not None:
+            results = {k: (answer, raw, zero_cost_meta(meta, dedup_of=dedup_of))
+                       for k, (answer, raw, meta) in results.items()}
+
+        # 回调在各个工作线程中执行，写 DataFrame 需要加锁
+        with lock:
+            for k, (answer, raw, meta) in results.items():
+                write_result(df, idx, k, answer, raw, meta)
+                if progress is not None:
+                    append_progress(progress, idx, k, answer, raw, meta)
+
+    return _cb
+
+
+# ========== Batch API ==========
+# 离线评测对时延不敏感，Batch API 在 24h 窗口内完成，费用约为实时调用的一半，且不占用实时接口的限流额度
+
+BATCH_REQUESTS_FILE = "./batch_requests.jsonl"
+BATCH_POLL_SECONDS = 30
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def build_batch_requests(
+    df: pd.DataFrame,
+    model_name: str,
+    path: str,
+    temperature: float = 0.2,
+    max_tokens: int = MAX_TOKENS,
+) -> Dict[Any, Any]:
+    """
+    为每个 (行号, prompt key) 生成一条 /v1/chat/completions 请求，写入 JSONL 文件
+    输入相同的行只生成一次请求
+    返回: {行号: 实际发出请求的行号}
+    """
+    sources: Dict[Any, Any] = {}
+    first_idx: Dict[bytes, Any] = {}
+
+    with open(path, "wb") as f:
+        for idx, row in df.iterrows():
+            fields = read_row(row)
+            key = input_key(fields)
+            if key in first_idx:
+                sources[idx] = first_idx[key]
+                continue
+            first_idx[key] = sources[idx] = idx
+
+            for k, template in PROMPTS.items():
+                line = {
+                    "custom_id": f"{idx}-{k}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": model_name,
+                        "messages": [{"role": "user", "content": build_prompt(template, *fields)}],
+                        "temperature": temperature,
+                        "max_tokens": max_tokens,
+                    },
+                }
+                f.write(orjson.dumps(line) + b"\n")
+
+    return sources
+
+
+def run_batch(llm: "OpenAIChatCompletion", path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    上传请求文件并创建 batch，轮询直到结束
+    返回: {custom_id: 输出文件中的一行}
+    """
+    with open(path, "rb") as f:
+        input_file = llm.client.files.create(file=f, purpose="batch")
+
+    batch = llm.client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print("已创建 batch：", batch.id)
+
+    while batch.status not in BATCH_FINAL_STATUSES:
+        time.sleep(BATCH_POLL_SECONDS)
+        batch = llm.client.batches.retrieve(batch.id)
+        print(f"batch 状态: {batch.status}, 进度: {batch.request_counts}")
+
+    if batch.status != "completed":
+        raise RuntimeError(f"batch {batch.id} 未完成，状态为 {batch.status}")
+
+    outputs: Dict[str, Dict[str, Any]] = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in llm.client.files.content(file_id).content.splitlines():
+            if line.strip():
+                item = orjson.loads(line)
+                outputs[item["custom_id"]] = item
+    return outputs
+
+
+def parse_batch_output(item: Optional[Dict[str, Any]]) -> Tuple[str, str, Dict[str, Any]]:
+    """把 batch 输出中的一行转换为 (answer, raw_output, meta)，与 tcm_diagnosis 的返回保持一致"""
     meta: Dict[str, Any] = {
-        "attempts": 0,
+        "attempts": 1,
         "total_seconds": 0.0,
+        "last_attempt_seconds": 0.0,
         "last_finish_reason": None,
         "last_usage": None,
         "error": None,
     }
 
-    last_raw = ""
-    start_total = time.perf_counter()
-
-    for attempt in range(max_retries + 1):
-        meta["attempts"] = attempt + 1
-        t0 = time.perf_counter()
+    if item is None:
+        meta["error"] = "missing_batch_output"
+        return "", "", meta
 
-        try:
-            response = llm.chat(
-                messages=[{"role": "user", "content": prompt}],
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
+    response = item.get("response") or {}
+    if item.get("error") or response.get("status_code") != 200:
+        meta["error"] = str(item.get("error") or response.get("body"))
+        return "", "", meta
 
-            dt = time.perf_counter() - t0
-            content = response.choices[0].message.content or ""
-            finish_reason = getattr(response.choices[0], "finish_reason", None)
-            usage = getattr(response, "usage", None)
-
-            meta["last_finish_reason"] = finish_reason
-            meta["last_usage"] = usage.model_dump() if hasattr(usage, "model_dump") else (dict(usage) if usage else None)
-
-            last_raw = content
-            answer = extract_answer(content)
-
-            has_open_answer = "<answer" in content.lower()
-            has_close_answer = "</answer>" in content.lower()
-            answer_tag_incomplete = has_open_answer and (not has_close_answer)
-
-            # 成功条件：必须抽到 answer，并且不是 length 截断，并且标签不是不完整
-            if answer and (finish_reason != "length") and (not answer_tag_incomplete):
-                meta["total_seconds"] = time.perf_counter() - start_total
-                meta["last_attempt_seconds"] = dt
-                meta["error"] = None
-                return answer, content, meta
-
-            meta["last_attempt_seconds"] = dt
-            meta["error"] = (
-                "incomplete_output("
-                f"answer_empty={not bool(answer)}, "
-                f"answer_tag_incomplete={answer_tag_incomplete}, "
-                f"finish_reason={finish_reason}"
-                ")"
-            )
+    body = response["body"]
+    choice = body["choices"][0]
+    content = choice["message"].get("content") or ""
 
-        except Exception as e:
-            dt = time.perf_counter() - t0
-            meta["last_attempt_seconds"] = dt
-            meta["error"] = f"{type(e).__name__}: {e}"
+    meta["last_finish_reason"] = choice.get("finish_reason")
+    usage = body.get("usage")
+    if usage:
+        meta["last_usage"] = (usage["prompt_tokens"], usage["completion_tokens"], usage["total_tokens"])
 
-        if attempt < max_retries:
-            backoff = (0.8 * (2 ** attempt)) + random.uniform(0, 0.3)
-            time.sleep(backoff)
-
-    meta["total_seconds"] = time.perf_counter() - start_total
-    return "", last_raw, meta
+    answer, meta["error"] = check_output(content, meta["last_finish_reason"])
+    return answer, content, meta
 
 
 def main():
@@ -355,6 +816,8 @@ def main():
     api_key = os.getenv("OPENAI_API_KEY")
     base_url = os.getenv("OPENAI_BASE_URL")
     model_name = os.getenv("OPENAI_MODEL")
+    # 服务商支持 Batch API 时设置 OPENAI_USE_BATCH=1
+    use_batch = os.getenv("OPENAI_USE_BATCH", "").lower() in ("1", "true", "yes")
 
     if not api_key:
         raise RuntimeError("未检测到 OPENAI_API_KEY，请先设置环境变量。")
@@ -367,60 +830,55 @@ def main():
 
     llm = OpenAIChatCompletion(api_key=api_key, base_url=base_url, model_name=model_name)
 
-    df = pd.read_excel(input_file)
+    df = read_input(input_file)
 
-    # the result file
-    for k in PROMPTS.keys():
-        df[f"中医辩证_{k}"] = ""
-        df[f"大模型输出_{k}"] = ""
-        df[f"尝试次数_{k}"] = 0
-        df[f"总耗时秒_{k}"] = 0.0
-        df[f"最后一次耗时秒_{k}"] = 0.0
-        df[f"finish_reason_{k}"] = ""
-        df[f"usage_{k}"] = ""
-        df[f"error_{k}"] = ""
-
-    max_workers = 16
-    futures = {}
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        for idx, row in df.iterrows():
-            basic_info = str(row.get("基本信息（脱敏）", "") or "")
-            chief_complaint = str(row.get("主诉", "") or "")
-            present_illness = str(row.get("现病史", "") or "")
-            four_diagnosis = str(row.get("四诊信息", "") or "")
+    init_result_columns(df)
 
+    if use_batch:
+        sources = build_batch_requests(df, model_name, BATCH_REQUESTS_FILE)
+        outputs = run_batch(llm, BATCH_REQUESTS_FILE)
+        for idx in df.index:
             for k in PROMPTS.keys():
-                fut = executor.submit(
-                    tcm_diagnosis,
-                    llm,
-                    k,  # 新增：传 prompt key
-                    basic_info,
-                    chief_complaint,
-                    present_illness,
-                    four_diagnosis,
-                )
-                futures[fut] = (idx, k)
-
-        for fut in as_completed(futures):
-            idx, k = futures[fut]
-            try:
-                answer, raw, meta = fut.result()
-            except Exception as e:
-                answer, raw, meta = "", "", {
-                    "attempts": 0, "total_seconds": 0.0, "last_attempt_seconds": 0.0,
-                    "last_finish_reason": "", "last_usage": None,
-                    "error": f"{type(e).__name__}: {e}"
-                }
+                answer, raw, meta = parse_batch_output(outputs.get(f"{sources[idx]}-{k}"))
+                if sources[idx] != idx:
+                    meta = zero_cost_meta(meta, dedup_of=sources[idx])
+                write_result(df, idx, k, answer, raw, meta)
+
+        df.to_excel(output_file, index=False)
+        print("处理完成，结果已写入：", output_file)
+        return
+
+    lock = threading.Lock()
+    # (输入指纹, prompt key 分组) -> (Future, 提交该任务的行号)，重复的行复用同一个 Future，结果通过回调写回所有行
+    futures: Dict[Tuple[bytes, Tuple[str, ...]], Tuple[Future, Any]] = {}
+
+    # 退出 with 时先 executor.shutdown(wait=True)，所有回调都已执行完毕，再关闭缓存和进度文件
+    # utf-8-sig 带 BOM，Excel 直接打开中文不乱码
+    with open(PROGRESS_CSV_FILE, "w", encoding="utf-8-sig", newline="") as progress, \
+            diskcache.Cache(LLM_CACHE_DIR) as cache, \
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        csv.writer(progress).writerow(PROGRESS_CSV_HEADER)
 
-            df.at[idx, f"中医辩证_{k}"] = answer
-            df.at[idx, f"大模型输出_{k}"] = raw
-            df.at[idx, f"尝试次数_{k}"] = meta.get("attempts", 0)
-            df.at[idx, f"总耗时秒_{k}"] = float(meta.get("total_seconds", 0.0) or 0.0)
-            df.at[idx, f"最后一次耗时秒_{k}"] = float(meta.get("last_attempt_seconds", 0.0) or 0.0)
-            df.at[idx, f"finish_reason_{k}"] = str(meta.get("last_finish_reason", "") or "")
-            df.at[idx, f"usage_{k}"] = str(meta.get("last_usage", "") or "")
-            df.at[idx, f"error_{k}"] = str(meta.get("error", "") or "")
+        for idx, row in df.iterrows():
+            basic_info, chief_complaint, present_illness, four_diagnosis = read_row(row)
+            key = input_key((basic_info, chief_complaint, present_illness, four_diagnosis))
+
+            for prompt_keys in PROMPT_GROUPS:
+                fut, source_idx = futures.get((key, prompt_keys), (None, idx))
+                if fut is None:
+                    fut = executor.submit(
+                        tcm_diagnosis,
+                        llm,
+                        prompt_keys,
+                        basic_info,
+                        chief_complaint,
+                        present_illness,
+                        four_diagnosis,
+                        cache=cache,
+                    )
+                    futures[(key, prompt_keys)] = (fut, idx)
+                dedup_of = None if source_idx == idx else source_idx
+                fut.add_done_callback(make_done_callback(df, lock, idx, prompt_keys, progress, dedup_of))
 
     df.to_excel(output_file, index=False)
     print("处理完成，结果已写入：", output_file)
@@ -118,6 +118,8 @@ async def root():
 
 
 if __name__ == "__main__":
+    import sys
+
     import uvicorn
 
     logger.info(f"正在启动 {settings.APP_NAME} v{settings.APP_VERSION}")
@@ -126,4 +128,7 @@ if __name__ == "__main__":
         host=settings.APP_HOST,
         port=settings.APP_PORT,
         reload=settings.APP_DEBUG,
+        # uvloop 不支持 Windows
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
     )
@@ -24,4 +24,7 @@ if __name__ == "__main__":
         port=settings.APP_PORT,
         reload=True,
         log_level="info",
+        # uvloop 不支持 Windows
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
     )
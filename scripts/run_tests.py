@@ -11,11 +11,12 @@ sys.path.insert(0, str(project_root))
 import pytest
 
 if __name__ == "__main__":
-    # 运行测试
+    # 运行测试，命令行参数原样传给 pytest（如 -n auto 开启多进程并行）
     exit_code = pytest.main([
         "tests/",
         "-v",
         "--tb=short",
         "--color=yes",
+        *sys.argv[1:],
     ])
     sys.exit(exit_code)
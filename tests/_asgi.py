@@ -0,0 +1,65 @@
+"""
+直接调用 ASGI 应用的测试辅助函数
+"""
+from typing import Any, Mapping, Optional, Tuple
+
+import orjson
+from starlette.types import ASGIApp, Message
+
+
+async def asgi_call(
+        app: ASGIApp,
+        method: str,
+        path: str,
+        headers: Optional[Mapping[str, str]] = None,
+        json: Any = None
+) -> Tuple[int, bytes]:
+    """
+    绕过 httpx 直接调用 ASGI 应用，返回 (状态码, 响应体)
+    只适用于关心路由与状态码的简单请求，不支持流式响应
+    """
+    path, _, query = path.partition("?")
+    body = orjson.dumps(json) if json is not None else b""
+
+    raw_headers = [(b"host", b"test")]
+    if json is not None:
+        raw_headers.append((b"content-type", b"application/json"))
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode("latin-1"), value.encode("latin-1")))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 123),
+        "server": ("test", 80),
+    }
+
+    request_sent = False
+
+    async def receive() -> Message:
+        nonlocal request_sent
+        if request_sent:
+            return {"type": "http.disconnect"}
+        request_sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    status = 0
+    chunks = []
+
+    async def send(message: Message) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
@@ -0,0 +1,24 @@
+"""
+测试用的只读数据
+"""
+from types import MappingProxyType
+from typing import Any, Mapping
+
+# TCM 诊断服务的模拟返回结果，各 AI 诊断测试共用同一份，只读以防被测试意外修改
+MOCK_DIAGNOSIS_RESULT: Mapping[str, Any] = MappingProxyType({
+    "overall_status": "success",
+    "medical_record_result": MappingProxyType({
+        "medical_record": "主诉：体重增加\n病史：身高175cm，体重85kg..."
+    }),
+    "diagnosis_result": MappingProxyType({
+        "diagnosis": "脾虚湿困型",
+        "diagnosis_explanation": "患者肢体困重，懒言少动..."
+    }),
+    "prescription_result": MappingProxyType({
+        "prescription": "党参 10g\n麸炒白术 15g\n茯苓 15g..."
+    }),
+    "exercise_prescription_result": MappingProxyType({
+        "exercise_prescription": "第一周：快走30分钟，每周5次..."
+    }),
+    "total_processing_time": 10.5,
+})
@@ -0,0 +1,56 @@
+"""
+测试请求体构造
+"""
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
+from uuid import uuid4
+
+# 测试用就诊记录 UUID 与患者手机号统一按序号生成，避免手写字面量出错或撞号
+_RECORD_UUID_PREFIX = "550e8400-e29b-41d4-a716-"
+_RECORD_UUID_BASE = 446655440000
+
+
+def record_uuid(i: int) -> str:
+    """第 i 个测试就诊记录的 UUID"""
+    return f"{_RECORD_UUID_PREFIX}{_RECORD_UUID_BASE + i:012d}"
+
+
+def patient_phone(i: int) -> str:
+    """第 i 个测试患者的手机号"""
+    return f"13800138{i:03d}"
+
+
+BASE_PATIENT_INFO: Mapping[str, Any] = MappingProxyType({
+    "name": "测试患者",
+    "sex": "MALE",
+    "birthday": "1985-01-01",
+})
+
+BASE_PRE_DIAGNOSIS: Mapping[str, Any] = MappingProxyType({
+    "height": 175.0,
+    "weight": 80.0,
+})
+
+# 请求体在模块加载时用 orjson 序列化一次，请求时以 content= 直接发送字节，需要手动带上该请求头
+JSON_HEADERS: Mapping[str, str] = MappingProxyType({"Content-Type": "application/json"})
+
+
+def make_record(
+        uuid: str,
+        phone: str,
+        patient: Optional[Mapping[str, Any]] = BASE_PATIENT_INFO,
+        **pre_diagnosis: Any
+) -> Dict[str, Any]:
+    """
+    构造创建就诊记录的请求体
+    patient 覆盖 BASE_PATIENT_INFO 中的字段，传 None 时不带 patient_info（为已有患者创建记录）；
+    其余关键字参数覆盖 BASE_PRE_DIAGNOSIS 中的字段
+    """
+    record = {
+        "uuid": uuid,
+        "patient_phone": phone,
+        "pre_diagnosis": {**BASE_PRE_DIAGNOSIS, "uuid": str(uuid4()), **pre_diagnosis},
+    }
+    if patient is not None:
+        record["patient_info"] = {**BASE_PATIENT_INFO, **patient, "phone": phone}
+    return record
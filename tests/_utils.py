@@ -0,0 +1,12 @@
+"""
+测试断言辅助函数
+"""
+from typing import Any
+
+import orjson
+from httpx import Response
+
+
+def j(resp: Response) -> Any:
+    """用 orjson 解析响应体，替代较慢的 response.json()"""
+    return orjson.loads(resp.content)
@@ -1,7 +1,9 @@
 """测试配置"""
 import asyncio
 import os
-from typing import AsyncGenerator
+from types import MappingProxyType
+from typing import AsyncGenerator, Mapping
+from unittest.mock import Mock
 
 # 设置测试环境变量（必须在导入app之前）
 os.environ.setdefault("DATABASE_HOST", "localhost")
@@ -13,83 +15,209 @@ os.environ.setdefault("AI_API_KEY", "test-api-key")
 os.environ.setdefault("AI_BASE_URL", "https://api.test.com")
 os.environ.setdefault("AI_MODEL_NAME", "test-model")
 os.environ.setdefault("JWT_SECRET_KEY", "test-secret-key")
+# bcrypt 允许的最小计算量，测试只关心哈希能否校验通过
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
 
 import pytest
+import pytest_asyncio
 from httpx import AsyncClient, ASGITransport
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy import delete, event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
 
-from app.core import hash_password, create_access_token, get_db, Base
+from app.core import create_access_token, get_db, Base
 from app.models import Doctor
+from app.services.tcm_diagnosis_service import TCMDiagnosisService
 from main import app
 
 TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
-test_engine = create_async_engine(TEST_DATABASE_URL, echo=False)
-test_session_maker = async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False)
 
+def pytest_asyncio_loop_factories(config, item):
+    """测试使用与生产环境 uvicorn 相同的 uvloop 事件循环；未安装 uvloop 时（Windows、cygwin、PyPy 等）回退到标准 asyncio"""
+    try:
+        import uvloop
+    except ImportError:
+        return {"asyncio": asyncio.new_event_loop}
 
-@pytest.fixture(scope="session")
-def event_loop():
-    """创建事件循环"""
-    loop = asyncio.get_event_loop_policy().new_event_loop()
-    yield loop
-    loop.close()
+    return {"uvloop": uvloop.new_event_loop}
 
+# 会话绑定到测试自己开启的连接上，业务代码里的 commit/rollback 只作用于 SAVEPOINT
+test_session_maker = async_sessionmaker(
+    class_=AsyncSession,
+    expire_on_commit=False,
+    join_transaction_mode="create_savepoint",
+)
 
-@pytest.fixture(scope="function")
-async def db_session() -> AsyncGenerator[AsyncSession, None]:
-    """创建测试数据库会话"""
+
+def _plain_hash_password(password: str) -> str:
+    """测试用的密码"哈希"：只需保证相同输入得到相同输出"""
+    return f"plain:{password}"
+
+
+def _plain_verify_password(plain_password: str, hashed_password: str) -> bool:
+    """测试用的密码校验"""
+    return hashed_password == _plain_hash_password(plain_password)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def plain_password_hasher():
+    """整个测试会话用明文比较替换 bcrypt，注册、登录、改密码等接口测试不再消耗 KDF 计算"""
+    with pytest.MonkeyPatch.context() as mp:
+        # app.api.doctor 通过 from app.core import 引入，需要替换使用方模块中的名字
+        for module in ("app.core.auth", "app.core", "app.api.doctor"):
+            mp.setattr(f"{module}.hash_password", _plain_hash_password)
+            mp.setattr(f"{module}.verify_password", _plain_verify_password)
+        yield
+
+
+def _disable_driver_transaction(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+def _emit_begin(conn):
+    conn.exec_driver_sql("BEGIN")
+
+
+@pytest_asyncio.fixture(scope="session")
+async def test_engine() -> AsyncGenerator[AsyncEngine, None]:
+    """整个测试会话共用的数据库引擎，会话结束时才释放连接"""
+    # 每个 :memory: 连接都是一个独立的空库，必须用 StaticPool 让所有测试共用同一个连接
+    engine = create_async_engine(TEST_DATABASE_URL, echo=False, poolclass=StaticPool)
+
+    # sqlite3 驱动会自行管理事务，导致 SAVEPOINT 无法正常工作，改为由 SQLAlchemy 显式发出 BEGIN
+    event.listen(engine.sync_engine, "connect", _disable_driver_transaction)
+    event.listen(engine.sync_engine, "begin", _emit_begin)
+
+    yield engine
+
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture(scope="session")
+async def db_schema(test_engine: AsyncEngine) -> AsyncGenerator[None, None]:
+    """整个测试会话只建一次表"""
     async with test_engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
-    async with test_session_maker() as session:
-        yield session
+    yield
 
     async with test_engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
 
 
 @pytest.fixture(scope="function")
-async def test_doctor(db_session: AsyncSession) -> Doctor:
-    """创建测试医生"""
-    doctor = Doctor(
-        username="test_doctor",
-        password_hash=hash_password("password123"),
-        name="测试医生",
-        gender="MALE",
-        phone="13900139000",
-        department="中医科",
-        position="主治医师",
-    )
-    db_session.add(doctor)
-    await db_session.commit()
-    await db_session.refresh(doctor)
+async def db_session(test_engine: AsyncEngine, db_schema: None) -> AsyncGenerator[AsyncSession, None]:
+    """创建测试数据库会话：每个测试运行在一个外层事务中，结束时整体回滚"""
+    async with test_engine.connect() as conn:
+        await conn.begin()
+
+        async with test_session_maker(bind=conn) as session:
+            yield session
+
+        await conn.rollback()
+
+
+@pytest_asyncio.fixture(scope="session")
+async def test_doctor(test_engine: AsyncEngine, db_schema: None) -> Doctor:
+    """创建测试医生：整个测试会话只创建一次，提交在每个测试的外层事务之外"""
+    async with test_session_maker(bind=test_engine) as session:
+        doctor = Doctor(
+            username="test_doctor",
+            password_hash=_plain_hash_password("password123"),
+            name="测试医生",
+            gender="MALE",
+            phone="13900139000",
+            department="中医科",
+            position="主治医师",
+        )
+        session.add(doctor)
+        await session.commit()
     return doctor
 
 
-@pytest.fixture(scope="function")
+@pytest.fixture(scope="session")
 def auth_token(test_doctor: Doctor) -> str:
     """创建测试认证令牌"""
     return create_access_token(data={"doctor_id": test_doctor.doctor_id, "username": test_doctor.username})
 
 
+@pytest.fixture(scope="session")
+def auth_headers(auth_token: str) -> Mapping[str, str]:
+    """创建认证请求头（只读，所有测试共用）"""
+    return MappingProxyType({"Authorization": f"Bearer {auth_token}"})
+
+
+@pytest_asyncio.fixture(scope="class")
+async def doctor_token(test_engine: AsyncEngine, db_schema: None) -> AsyncGenerator[str, None]:
+    """
+    整个测试类共用的已登录医生（doctor_zhang），返回 access_token
+    医生在每个测试的外层事务之外提交，测试中的修改仍会随测试回滚；测试类结束时删除
+    """
+    async with test_session_maker(bind=test_engine) as session:
+        doctor = Doctor(
+            username="doctor_zhang",
+            password_hash=_plain_hash_password("password123"),
+            name="张医生",
+            gender="MALE",
+            phone="13800138000",
+            department="中医科",
+            position="主治医师",
+        )
+        session.add(doctor)
+        await session.commit()
+        token = create_access_token(data={"doctor_id": doctor.doctor_id, "username": doctor.username})
+
+    yield token
+
+    async with test_session_maker(bind=test_engine) as session:
+        await session.execute(delete(Doctor).where(Doctor.doctor_id == doctor.doctor_id))
+        await session.commit()
+
+
 @pytest.fixture(scope="function")
-def auth_headers(auth_token: str) -> dict:
-    """创建认证请求头"""
-    return {"Authorization": f"Bearer {auth_token}"}
+def mock_tcm_service(monkeypatch: pytest.MonkeyPatch) -> Mock:
+    """替换患者接口使用的 TCM 诊断服务，诊断结果由各测试自行配置"""
+    service = Mock(spec=TCMDiagnosisService)
+    monkeypatch.setattr("app.api.patient.get_tcm_service", lambda: service)
+    return service
+
+
+@pytest_asyncio.fixture(scope="session")
+async def transport() -> ASGITransport:
+    """整个测试会话共用的 ASGI 传输层"""
+    # ASGITransport 不会触发 lifespan，应用启动时的 init_db（连接 PostgreSQL 建表）不会执行，
+    # 测试库的建表由 db_schema 在会话级完成一次
+    return ASGITransport(app=app)
+
+
+@pytest_asyncio.fixture(scope="session")
+async def base_client(transport: ASGITransport) -> AsyncGenerator[AsyncClient, None]:
+    """整个测试会话共用的 HTTP 客户端，避免每个测试重复创建和关闭"""
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        # 预热：首个请求会构建应用的中间件栈，避免把这部分开销算到第一个测试上
+        await ac.get("/health")
+        yield ac
 
 
 @pytest.fixture(scope="function")
-async def client(db_session: AsyncSession) -> AsyncGenerator[AsyncClient, None]:
-    """创建测试客户端"""
+def db_override(db_session: AsyncSession):
+    """把应用的数据库依赖替换为当前测试的会话"""
 
     async def override_get_db():
         yield db_session
 
     app.dependency_overrides[get_db] = override_get_db
 
-    transport = ASGITransport(app=app)
-    async with AsyncClient(transport=transport, base_url="http://test") as ac:
-        yield ac
+    yield
 
     app.dependency_overrides.clear()
+
+
+@pytest.fixture(scope="function")
+async def client(base_client: AsyncClient, db_override: None) -> AsyncGenerator[AsyncClient, None]:
+    """创建测试客户端：复用会话级客户端，每个测试只替换数据库依赖并重置请求状态"""
+    yield base_client
+
+    base_client.cookies.clear()
+    base_client.headers.pop("Authorization", None)
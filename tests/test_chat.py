@@ -1,26 +1,73 @@
 """
 聊天 API 测试
 """
-from unittest.mock import Mock, patch, AsyncMock
+from dataclasses import dataclass
+from typing import Tuple
+from unittest.mock import Mock
 
+import orjson
 import pytest
 from httpx import AsyncClient
 
+from tests._payloads import JSON_HEADERS, make_record, patient_phone, record_uuid
+from tests._utils import j
+
+_RECORD_BYTES = orjson.dumps(make_record(
+    record_uuid(100),
+    patient_phone(100),
+    patient={"name": "聊天测试患者"},
+    weight=70.0
+))
+
+
+@dataclass(frozen=True, slots=True)
+class FakeMessage:
+    content: str
+
+
+@dataclass(frozen=True, slots=True)
+class FakeChoice:
+    message: FakeMessage
+
+
+@dataclass(frozen=True, slots=True)
+class FakeCompletion:
+    """chat.completions.create 返回值的替身，只包含聊天服务读取的字段"""
+    choices: Tuple[FakeChoice, ...]
+
+
+@pytest.fixture
+def mock_openai_class(monkeypatch: pytest.MonkeyPatch) -> Mock:
+    """替换聊天服务使用的 OpenAI 客户端类，实例的非流式接口返回固定回复"""
+    fake = Mock()
+    fake.return_value.client.chat.completions.create.return_value = FakeCompletion(
+        choices=(FakeChoice(message=FakeMessage(content="您好！我是小康，很高兴为您服务。")),)
+    )
+    monkeypatch.setattr("app.services.chat_service.OpenAIChatCompletion", fake)
+    return fake
+
+
+@pytest.fixture
+async def session_id(client: AsyncClient) -> str:
+    """创建一个新会话，返回 session_id"""
+    response = await client.post("/api/v1/chat/conversation", json={})
+    assert response.status_code == 201
+    return j(response)["data"]["session_id"]
+
 
 # ========== 创建会话测试 ==========
-@pytest.mark.asyncio
 async def test_create_conversation_success(client: AsyncClient):
     """测试成功创建会话"""
     response = await client.post("/api/v1/chat/conversation", json={})
 
     assert response.status_code == 201
-    data = response.json()
+    data = j(response)
     assert data["success"] is True
-    assert "session_id" in data["data"]
-    assert data["data"]["is_active"] is True
+    payload = data["data"]
+    assert "session_id" in payload
+    assert payload["is_active"] is True
 
 
-@pytest.mark.asyncio
 async def test_create_conversation_with_initial_context(client: AsyncClient):
     """测试带初始上下文创建会话"""
     request_data = {
@@ -31,12 +78,11 @@ async def test_create_conversation_with_initial_context(client: AsyncClient):
     response = await client.post("/api/v1/chat/conversation", json=request_data)
 
     assert response.status_code == 201
-    data = response.json()
+    data = j(response)
     assert data["success"] is True
     assert "session_id" in data["data"]
 
 
-@pytest.mark.asyncio
 async def test_create_conversation_with_custom_system_prompt(client: AsyncClient):
     """测试带自定义系统提示词创建会话"""
     request_data = {
@@ -47,90 +93,71 @@ async def test_create_conversation_with_custom_system_prompt(client: AsyncClient
     response = await client.post("/api/v1/chat/conversation", json=request_data)
 
     assert response.status_code == 201
-    data = response.json()
+    data = j(response)
     assert data["success"] is True
 
 
 # ========== 获取会话测试 ==========
-@pytest.mark.asyncio
-async def test_get_conversation_success(client: AsyncClient):
+async def test_get_conversation_success(client: AsyncClient, session_id: str):
     """测试成功获取会话详情"""
-    # 先创建会话
-    create_response = await client.post("/api/v1/chat/conversation", json={})
-    assert create_response.status_code == 201
-    session_id = create_response.json()["data"]["session_id"]
-
     # 获取会话详情
     response = await client.get(f"/api/v1/chat/conversation/{session_id}")
 
     assert response.status_code == 200
-    data = response.json()
+    data = j(response)
     assert data["success"] is True
-    assert data["data"]["session_id"] == session_id
-    assert isinstance(data["data"]["messages"], list)
+    payload = data["data"]
+    assert payload["session_id"] == session_id
+    assert isinstance(payload["messages"], list)
 
 
-@pytest.mark.asyncio
 async def test_get_conversation_not_found(client: AsyncClient):
     """测试获取不存在的会话"""
     response = await client.get("/api/v1/chat/conversation/non-existent-session-id")
 
     assert response.status_code == 404
-    data = response.json()
+    data = j(response)
     assert data["success"] is False
 
 
 # ========== 非流式聊天测试 ==========
-@pytest.mark.asyncio
-async def test_chat_success(client: AsyncClient):
+async def test_chat_success(client: AsyncClient, session_id: str, mock_openai_class: Mock):
     """测试成功发送消息（非流式）"""
-    # 先创建会话
-    create_response = await client.post("/api/v1/chat/conversation", json={})
-    assert create_response.status_code == 201
-    session_id = create_response.json()["data"]["session_id"]
-
-    # Mock AI客户端
-    with patch('app.services.chat_service.OpenAIChatCompletion') as mock_ai_class:
-        mock_ai_instance = Mock()
-        mock_ai_instance.client.chat.completions.create.return_value = Mock(
-            choices=[Mock(message=Mock(content="您好！我是小康，很高兴为您服务。"))]
-        )
-        mock_ai_class.return_value = mock_ai_instance
-
-        # 发送消息
-        chat_data = {
-            "session_id": session_id,
-            "content": "你好"
-        }
-
-        response = await client.post("/api/v1/chat/chat", json=chat_data)
-
-        assert response.status_code == 200
-        data = response.json()
-        assert data["success"] is True
-        assert "response" in data["data"]
+    # 发送消息
+    chat_data = {
+        "session_id": session_id,
+        "content": "你好"
+    }
 
+    response = await client.post("/api/v1/chat/chat", json=chat_data)
 
-@pytest.mark.asyncio
-async def test_chat_session_not_found(client: AsyncClient):
-    """测试向不存在的会话发送消息"""
+    assert response.status_code == 200
+    data = j(response)
+    assert data["success"] is True
+    assert "response" in data["data"]
+
+
+@pytest.mark.parametrize(
+    "endpoint",
+    [
+        pytest.param("/api/v1/chat/chat", id="chat"),
+        pytest.param("/api/v1/chat/chat/stream", id="stream"),
+    ],
+)
+async def test_chat_session_not_found(client: AsyncClient, endpoint: str):
+    """测试向不存在的会话发送消息（非流式与流式）"""
     chat_data = {
         "session_id": "non-existent-session-id",
         "content": "你好"
     }
 
-    response = await client.post("/api/v1/chat/chat", json=chat_data)
+    response = await client.post(endpoint, json=chat_data)
 
     assert response.status_code == 404
 
 
-@pytest.mark.asyncio
-async def test_chat_empty_content(client: AsyncClient):
+async def test_chat_empty_content(client: AsyncClient, session_id: str):
     """测试发送空消息"""
-    # 先创建会话
-    create_response = await client.post("/api/v1/chat/conversation", json={})
-    session_id = create_response.json()["data"]["session_id"]
-
     chat_data = {
         "session_id": session_id,
         "content": ""
@@ -143,74 +170,41 @@ async def test_chat_empty_content(client: AsyncClient):
 
 
 # ========== 流式聊天测试 ==========
-@pytest.mark.asyncio
-async def test_chat_stream_success(client: AsyncClient):
+async def test_chat_stream_success(client: AsyncClient, session_id: str, mock_openai_class: Mock):
     """测试成功发送消息（流式）"""
-    # 先创建会话
-    create_response = await client.post("/api/v1/chat/conversation", json={})
-    assert create_response.status_code == 201
-    session_id = create_response.json()["data"]["session_id"]
-
     # Mock AI客户端的异步流式聊天
     async def mock_stream():
         yield "您好！"
         yield "我是小康。"
         yield "很高兴为您服务。"
 
-    with patch('app.services.chat_service.OpenAIChatCompletion') as mock_ai_class:
-        mock_ai_instance = Mock()
-        mock_ai_instance.async_stream_chat = Mock(return_value=mock_stream())
-        mock_ai_class.return_value = mock_ai_instance
+    mock_openai_class.return_value.async_stream_chat = Mock(return_value=mock_stream())
 
-        # 发送流式消息
-        chat_data = {
-            "session_id": session_id,
-            "content": "你好"
-        }
-
-        response = await client.post("/api/v1/chat/chat/stream", json=chat_data)
-
-        assert response.status_code == 200
-        assert response.headers["content-type"] == "text/event-stream; charset=utf-8"
-
-
-@pytest.mark.asyncio
-async def test_chat_stream_session_not_found(client: AsyncClient):
-    """测试向不存在的会话发送流式消息"""
+    # 发送流式消息
     chat_data = {
-        "session_id": "non-existent-session-id",
+        "session_id": session_id,
         "content": "你好"
     }
 
-    response = await client.post("/api/v1/chat/chat/stream", json=chat_data)
-
-    assert response.status_code == 404
+    # 只校验响应头，不读取响应体
+    async with client.stream("POST", "/api/v1/chat/chat/stream", json=chat_data) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "text/event-stream; charset=utf-8"
 
 
 # ========== 关闭会话测试 ==========
-@pytest.mark.asyncio
-async def test_close_conversation_success(client: AsyncClient):
+async def test_close_conversation_success(client: AsyncClient, session_id: str):
     """测试成功关闭会话"""
-    # 先创建会话
-    create_response = await client.post("/api/v1/chat/conversation", json={})
-    assert create_response.status_code == 201
-    session_id = create_response.json()["data"]["session_id"]
-
     # 关闭会话
     response = await client.delete(f"/api/v1/chat/conversation/{session_id}")
 
     assert response.status_code == 200
-    data = response.json()
+    data = j(response)
     assert data["success"] is True
     assert data["data"]["session_id"] == session_id
+    # 关闭后的会话状态由 test_chat_to_closed_conversation 覆盖
 
-    # 验证会话已关闭
-    get_response = await client.get(f"/api/v1/chat/conversation/{session_id}")
-    assert get_response.status_code == 200
-    assert get_response.json()["data"]["is_active"] is False
 
-
-@pytest.mark.asyncio
 async def test_close_conversation_not_found(client: AsyncClient):
     """测试关闭不存在的会话"""
     response = await client.delete("/api/v1/chat/conversation/non-existent-session-id")
@@ -218,18 +212,17 @@ async def test_close_conversation_not_found(client: AsyncClient):
     assert response.status_code == 404
 
 
-@pytest.mark.asyncio
-async def test_chat_to_closed_conversation(client: AsyncClient):
+async def test_chat_to_closed_conversation(client: AsyncClient, session_id: str):
     """测试向已关闭的会话发送消息"""
-    # 先创建会话
-    create_response = await client.post("/api/v1/chat/conversation", json={})
-    assert create_response.status_code == 201
-    session_id = create_response.json()["data"]["session_id"]
-
     # 关闭会话
     close_response = await client.delete(f"/api/v1/chat/conversation/{session_id}")
     assert close_response.status_code == 200
 
+    # 验证会话已关闭
+    get_response = await client.get(f"/api/v1/chat/conversation/{session_id}")
+    assert get_response.status_code == 200
+    assert j(get_response)["data"]["is_active"] is False
+
     # 尝试向已关闭的会话发送流式消息
     chat_data = {
         "session_id": session_id,
@@ -240,44 +233,30 @@ async def test_chat_to_closed_conversation(client: AsyncClient):
 
     # 应该返回错误（会话已关闭）- ValidationException返回400
     assert response.status_code == 400
-    data = response.json()
+    data = j(response)
     assert data["success"] is False
 
 
 # ========== 会话消息历史测试 ==========
-@pytest.mark.asyncio
-async def test_conversation_message_history(client: AsyncClient):
+async def test_conversation_message_history(client: AsyncClient, session_id: str, mock_openai_class: Mock):
     """测试会话消息历史记录"""
-    # 创建会话
-    create_response = await client.post("/api/v1/chat/conversation", json={})
-    assert create_response.status_code == 201
-    session_id = create_response.json()["data"]["session_id"]
-
-    # Mock AI客户端并发送多条消息
-    with patch('app.services.chat_service.OpenAIChatCompletion') as mock_ai_class:
-        mock_ai_instance = Mock()
-        mock_ai_instance.client.chat.completions.create.return_value = Mock(
-            choices=[Mock(message=Mock(content="这是AI的回复。"))]
-        )
-        mock_ai_class.return_value = mock_ai_instance
-
-        # 发送第一条消息
-        await client.post("/api/v1/chat/chat", json={
-            "session_id": session_id,
-            "content": "第一条消息"
-        })
-
-        # 发送第二条消息
-        await client.post("/api/v1/chat/chat", json={
-            "session_id": session_id,
-            "content": "第二条消息"
-        })
+    # 发送第一条消息
+    await client.post("/api/v1/chat/chat", json={
+        "session_id": session_id,
+        "content": "第一条消息"
+    })
+
+    # 发送第二条消息
+    await client.post("/api/v1/chat/chat", json={
+        "session_id": session_id,
+        "content": "第二条消息"
+    })
 
     # 获取会话历史
     response = await client.get(f"/api/v1/chat/conversation/{session_id}")
 
     assert response.status_code == 200
-    data = response.json()
+    data = j(response)
     messages = data["data"]["messages"]
 
     # 应该有4条消息（2条用户消息 + 2条AI回复）
@@ -291,13 +270,8 @@ async def test_conversation_message_history(client: AsyncClient):
 
 
 # ========== 输入验证测试 ==========
-@pytest.mark.asyncio
-async def test_chat_content_too_long(client: AsyncClient):
+async def test_chat_content_too_long(client: AsyncClient, session_id: str):
     """测试消息内容超长"""
-    # 先创建会话
-    create_response = await client.post("/api/v1/chat/conversation", json={})
-    session_id = create_response.json()["data"]["session_id"]
-
     # 发送超长消息（超过10000字符）
     chat_data = {
         "session_id": session_id,
@@ -310,27 +284,10 @@ async def test_chat_content_too_long(client: AsyncClient):
     assert response.status_code == 422
 
 
-@pytest.mark.asyncio
 async def test_create_conversation_with_patient_id(client: AsyncClient):
     """测试创建关联患者的会话"""
     # 先创建患者（通过创建就诊记录）
-    record_data = {
-        "uuid": "550e8400-e29b-41d4-a716-446655440100",
-        "patient_phone": "13800138100",
-        "patient_info": {
-            "name": "聊天测试患者",
-            "sex": "MALE",
-            "birthday": "1985-01-01",
-            "phone": "13800138100"
-        },
-        "pre_diagnosis": {
-            "uuid": "660e8400-e29b-41d4-a716-446655440100",
-            "height": 175.0,
-            "weight": 70.0
-        }
-    }
-
-    await client.post("/api/v1/medical-record", json=record_data)
+    await client.post("/api/v1/medical-record", content=_RECORD_BYTES, headers=JSON_HEADERS)
 
     # 创建关联患者的会话（patient_id=1，假设是第一个创建的患者）
     request_data = {
@@ -341,6 +298,6 @@ async def test_create_conversation_with_patient_id(client: AsyncClient):
     response = await client.post("/api/v1/chat/conversation", json=request_data)
 
     assert response.status_code == 201
-    data = response.json()
+    data = j(response)
     assert data["success"] is True
 
@@ -1,12 +1,23 @@
 """
 医生管理相关API测试
 """
+import orjson
 import pytest
 from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import AsyncSession
 
+# 模块加载（收集测试）时 plain_password_hasher 尚未生效，这里拿到的是真实的 bcrypt 实现
+from app.core.auth import hash_password, verify_password
+from tests._payloads import JSON_HEADERS, make_record, patient_phone, record_uuid
+from tests._utils import j
+
+_RECORD_BYTES = orjson.dumps(make_record(
+    record_uuid(1),
+    patient_phone(1),
+    patient={"name": "张三", "birthday": "1985-05-20"}
+))
+
 
-@pytest.mark.asyncio
 class TestDoctorRegistration:
     """医生注册测试"""
 
@@ -26,13 +37,14 @@ class TestDoctorRegistration:
         response = await client.post("/api/v1/doctor/register", json=doctor_data)
 
         assert response.status_code == 201
-        data = response.json()
+        data = j(response)
         assert data["success"] is True
         assert data["message"] == "医生注册成功"
-        assert data["data"]["username"] == "doctor_zhang"
-        assert data["data"]["name"] == "张医生"
-        assert "password" not in data["data"]
-        assert "password_hash" not in data["data"]
+        payload = data["data"]
+        assert payload["username"] == "doctor_zhang"
+        assert payload["name"] == "张医生"
+        assert "password" not in payload
+        assert "password_hash" not in payload
 
     async def test_register_doctor_duplicate_username(self, client: AsyncClient):
         """测试重复用户名注册"""
@@ -52,7 +64,7 @@ class TestDoctorRegistration:
         response = await client.post("/api/v1/doctor/register", json=doctor_data)
 
         assert response.status_code == 409
-        data = response.json()
+        data = j(response)
         assert data["success"] is False
         assert "用户名" in data["message"]
 
@@ -74,46 +86,27 @@ class TestDoctorRegistration:
         response = await client.post("/api/v1/doctor/register", json=doctor_data)
 
         assert response.status_code == 409
-        data = response.json()
+        data = j(response)
         assert data["success"] is False
         assert "手机号" in data["message"]
 
-    async def test_register_doctor_invalid_username(self, client: AsyncClient):
-        """测试无效用户名"""
-        doctor_data = {
-            "username": "doctor-zhang",  # 包含不允许的字符
-            "password": "password123",
-            "name": "张医生",
-            "gender": "MALE",
-            "phone": "13800138000"
-        }
-
-        response = await client.post("/api/v1/doctor/register", json=doctor_data)
-
-        assert response.status_code == 422  # Validation error
-
-    async def test_register_doctor_invalid_phone(self, client: AsyncClient):
-        """测试无效手机号"""
+    @pytest.mark.parametrize(
+        "field, value",
+        [
+            pytest.param("username", "doctor-zhang", id="invalid_username"),  # 包含不允许的字符
+            pytest.param("phone", "12345678901", id="invalid_phone"),  # 无效手机号
+            pytest.param("password", "12345", id="short_password"),  # 少于6位
+        ],
+    )
+    async def test_register_doctor_invalid(self, client: AsyncClient, field: str, value: str):
+        """测试注册参数校验失败"""
         doctor_data = {
             "username": "doctor_zhang",
             "password": "password123",
             "name": "张医生",
             "gender": "MALE",
-            "phone": "12345678901"  # 无效手机号
-        }
-
-        response = await client.post("/api/v1/doctor/register", json=doctor_data)
-
-        assert response.status_code == 422  # Validation error
-
-    async def test_register_doctor_short_password(self, client: AsyncClient):
-        """测试密码过短"""
-        doctor_data = {
-            "username": "doctor_zhang",
-            "password": "12345",  # 少于6位
-            "name": "张医生",
-            "gender": "MALE",
-            "phone": "13800138000"
+            "phone": "13800138000",
+            field: value,
         }
 
         response = await client.post("/api/v1/doctor/register", json=doctor_data)
@@ -121,7 +114,6 @@ class TestDoctorRegistration:
         assert response.status_code == 422  # Validation error
 
 
-@pytest.mark.asyncio
 class TestDoctorLogin:
     """医生登录测试"""
 
@@ -145,13 +137,15 @@ class TestDoctorLogin:
         response = await client.post("/api/v1/doctor/login", json=login_data)
 
         assert response.status_code == 200
-        data = response.json()
+        data = j(response)
         assert data["success"] is True
         assert data["message"] == "登录成功"
-        assert "access_token" in data["data"]
-        assert data["data"]["token_type"] == "bearer"
-        assert data["data"]["doctor"]["username"] == "doctor_zhang"
-        assert "password" not in data["data"]["doctor"]
+        payload = data["data"]
+        doctor = payload["doctor"]
+        assert "access_token" in payload
+        assert payload["token_type"] == "bearer"
+        assert doctor["username"] == "doctor_zhang"
+        assert "password" not in doctor
 
     async def test_login_with_phone_success(self, client: AsyncClient):
         """测试使用手机号成功登录"""
@@ -173,17 +167,28 @@ class TestDoctorLogin:
         response = await client.post("/api/v1/doctor/login", json=login_data)
 
         assert response.status_code == 200
-        data = response.json()
+        data = j(response)
         assert data["success"] is True
         assert data["message"] == "登录成功"
-        assert "access_token" in data["data"]
-        assert data["data"]["token_type"] == "bearer"
-        assert data["data"]["doctor"]["username"] == "doctor_li"
-        assert data["data"]["doctor"]["phone"] == "13800138001"
-        assert "password" not in data["data"]["doctor"]
-
-    async def test_login_wrong_password(self, client: AsyncClient):
-        """测试错误密码"""
+        payload = data["data"]
+        doctor = payload["doctor"]
+        assert "access_token" in payload
+        assert payload["token_type"] == "bearer"
+        assert doctor["username"] == "doctor_li"
+        assert doctor["phone"] == "13800138001"
+        assert "password" not in doctor
+
+    @pytest.mark.parametrize(
+        "username, password",
+        [
+            pytest.param("doctor_zhang", "wrongpassword", id="wrong_password"),
+            pytest.param("13800138000", "wrongpassword", id="phone_wrong_password"),
+            pytest.param("nonexistent_user", "password123", id="nonexistent_user"),
+            pytest.param("13999999999", "password123", id="nonexistent_phone"),
+        ],
+    )
+    async def test_login_failure(self, client: AsyncClient, username: str, password: str):
+        """测试登录失败：密码错误或用户不存在"""
         # 先注册医生
         register_data = {
             "username": "doctor_zhang",
@@ -194,104 +199,34 @@ class TestDoctorLogin:
         }
         await client.post("/api/v1/doctor/register", json=register_data)
 
-        # 使用错误密码登录
-        login_data = {
-            "username": "doctor_zhang",
-            "password": "wrongpassword"
-        }
-        response = await client.post("/api/v1/doctor/login", json=login_data)
-
-        assert response.status_code == 401
-        data = response.json()
-        assert data["detail"] == "用户名/手机号或密码错误"
-
-    async def test_login_with_phone_wrong_password(self, client: AsyncClient):
-        """测试使用手机号但密码错误"""
-        # 先注册医生
-        register_data = {
-            "username": "doctor_wang",
-            "password": "password123",
-            "name": "王医生",
-            "gender": "MALE",
-            "phone": "13800138002"
-        }
-        await client.post("/api/v1/doctor/register", json=register_data)
-
-        # 使用手机号但错误密码登录
         login_data = {
-            "username": "13800138002",
-            "password": "wrongpassword"
+            "username": username,
+            "password": password
         }
         response = await client.post("/api/v1/doctor/login", json=login_data)
 
         assert response.status_code == 401
-        data = response.json()
+        data = j(response)
         assert data["detail"] == "用户名/手机号或密码错误"
 
-    async def test_login_nonexistent_user(self, client: AsyncClient):
-        """测试不存在的用户"""
-        login_data = {
-            "username": "nonexistent_user",
-            "password": "password123"
-        }
-        response = await client.post("/api/v1/doctor/login", json=login_data)
-
-        assert response.status_code == 401
-        data = response.json()
-        assert data["detail"] == "用户名/手机号或密码错误"
-
-    async def test_login_nonexistent_phone(self, client: AsyncClient):
-        """测试不存在的手机号"""
-        login_data = {
-            "username": "13999999999",
-            "password": "password123"
-        }
-        response = await client.post("/api/v1/doctor/login", json=login_data)
 
-        assert response.status_code == 401
-        data = response.json()
-        assert data["detail"] == "用户名/手机号或密码错误"
-
-
-@pytest.mark.asyncio
 class TestDoctorInfo:
     """医生信息管理测试"""
 
-    async def register_and_login(self, client: AsyncClient) -> str:
-        """辅助方法：注册并登录，返回access_token"""
-        register_data = {
-            "username": "doctor_zhang",
-            "password": "password123",
-            "name": "张医生",
-            "gender": "MALE",
-            "phone": "13800138000",
-            "department": "中医科",
-            "position": "主治医师"
-        }
-        await client.post("/api/v1/doctor/register", json=register_data)
-
-        login_data = {
-            "username": "doctor_zhang",
-            "password": "password123"
-        }
-        response = await client.post("/api/v1/doctor/login", json=login_data)
-        return response.json()["data"]["access_token"]
-
-    async def test_get_current_doctor_info(self, client: AsyncClient):
+    async def test_get_current_doctor_info(self, client: AsyncClient, doctor_token: str):
         """测试获取当前医生信息"""
-        access_token = await self.register_and_login(client)
-
         response = await client.get(
             "/api/v1/doctor/me",
-            headers={"Authorization": f"Bearer {access_token}"}
+            headers={"Authorization": f"Bearer {doctor_token}"}
         )
 
         assert response.status_code == 200
-        data = response.json()
+        data = j(response)
         assert data["success"] is True
-        assert data["data"]["username"] == "doctor_zhang"
-        assert data["data"]["name"] == "张医生"
-        assert data["data"]["department"] == "中医科"
+        payload = data["data"]
+        assert payload["username"] == "doctor_zhang"
+        assert payload["name"] == "张医生"
+        assert payload["department"] == "中医科"
 
     async def test_get_current_doctor_info_without_auth(self, client: AsyncClient):
         """测试未认证获取医生信息"""
@@ -308,10 +243,8 @@ class TestDoctorInfo:
 
         assert response.status_code == 401
 
-    async def test_update_doctor_info(self, client: AsyncClient):
+    async def test_update_doctor_info(self, client: AsyncClient, doctor_token: str):
         """测试更新医生信息"""
-        access_token = await self.register_and_login(client)
-
         update_data = {
             "name": "张伟",
             "position": "副主任医师",
@@ -321,22 +254,20 @@ class TestDoctorInfo:
         response = await client.put(
             "/api/v1/doctor/me",
             json=update_data,
-            headers={"Authorization": f"Bearer {access_token}"}
+            headers={"Authorization": f"Bearer {doctor_token}"}
         )
 
         assert response.status_code == 200
-        data = response.json()
+        data = j(response)
         assert data["success"] is True
-        assert data["data"]["name"] == "张伟"
-        assert data["data"]["position"] == "副主任医师"
-        assert data["data"]["bio"] == "擅长中医诊疗和运动康复"
-        assert data["data"]["username"] == "doctor_zhang"  # username不可修改
+        payload = data["data"]
+        assert payload["name"] == "张伟"
+        assert payload["position"] == "副主任医师"
+        assert payload["bio"] == "擅长中医诊疗和运动康复"
+        assert payload["username"] == "doctor_zhang"  # username不可修改
 
-    async def test_update_doctor_phone_duplicate(self, client: AsyncClient):
+    async def test_update_doctor_phone_duplicate(self, client: AsyncClient, doctor_token: str):
         """测试更新为已存在的手机号"""
-        # 注册第一个医生
-        access_token1 = await self.register_and_login(client)
-
         # 注册第二个医生
         register_data2 = {
             "username": "doctor_li",
@@ -355,41 +286,37 @@ class TestDoctorInfo:
         response = await client.put(
             "/api/v1/doctor/me",
             json=update_data,
-            headers={"Authorization": f"Bearer {access_token1}"}
+            headers={"Authorization": f"Bearer {doctor_token}"}
         )
 
         assert response.status_code == 409
-        data = response.json()
+        data = j(response)
         assert data["success"] is False
         assert "手机号" in data["message"]
 
 
-@pytest.mark.asyncio
-class TestPasswordChange:
-    """密码修改测试"""
+class TestPasswordHashing:
+    """密码哈希测试：直接调用真实的 bcrypt 实现"""
 
-    async def register_and_login(self, client: AsyncClient) -> str:
-        """辅助方法：注册并登录，返回access_token"""
-        register_data = {
-            "username": "doctor_zhang",
-            "password": "password123",
-            "name": "张医生",
-            "gender": "MALE",
-            "phone": "13800138000"
-        }
-        await client.post("/api/v1/doctor/register", json=register_data)
+    def test_hash_and_verify_round_trip(self):
+        """测试哈希后能用原密码校验通过，且使用配置的计算量"""
+        hashed = hash_password("password123")
 
-        login_data = {
-            "username": "doctor_zhang",
-            "password": "password123"
-        }
-        response = await client.post("/api/v1/doctor/login", json=login_data)
-        return response.json()["data"]["access_token"]
+        assert hashed.startswith("$2b$04$")
+        assert verify_password("password123", hashed) is True
 
-    async def test_change_password_success(self, client: AsyncClient):
-        """测试成功修改密码"""
-        access_token = await self.register_and_login(client)
+    def test_verify_wrong_password(self):
+        """测试错误密码校验失败"""
+        hashed = hash_password("password123")
+
+        assert verify_password("wrongpassword", hashed) is False
+
+
+class TestPasswordChange:
+    """密码修改测试"""
 
+    async def test_change_password_success(self, client: AsyncClient, doctor_token: str):
+        """测试成功修改密码"""
         password_data = {
             "old_password": "password123",
             "new_password": "newpassword456"
@@ -398,11 +325,11 @@ class TestPasswordChange:
         response = await client.post(
             "/api/v1/doctor/change-password",
             json=password_data,
-            headers={"Authorization": f"Bearer {access_token}"}
+            headers={"Authorization": f"Bearer {doctor_token}"}
         )
 
         assert response.status_code == 200
-        data = response.json()
+        data = j(response)
         assert data["success"] is True
         assert data["message"] == "密码修改成功"
 
@@ -422,10 +349,8 @@ class TestPasswordChange:
         old_login_response = await client.post("/api/v1/doctor/login", json=old_login_data)
         assert old_login_response.status_code == 401
 
-    async def test_change_password_wrong_old_password(self, client: AsyncClient):
+    async def test_change_password_wrong_old_password(self, client: AsyncClient, doctor_token: str):
         """测试旧密码错误"""
-        access_token = await self.register_and_login(client)
-
         password_data = {
             "old_password": "wrongpassword",
             "new_password": "newpassword456"
@@ -434,11 +359,11 @@ class TestPasswordChange:
         response = await client.post(
             "/api/v1/doctor/change-password",
             json=password_data,
-            headers={"Authorization": f"Bearer {access_token}"}
+            headers={"Authorization": f"Bearer {doctor_token}"}
         )
 
         assert response.status_code == 400
-        data = response.json()
+        data = j(response)
         assert data["success"] is False
         assert "旧密码不正确" in data["message"]
 
@@ -457,7 +382,6 @@ class TestPasswordChange:
         assert response.status_code == 401  # Unauthorized
 
 
-@pytest.mark.asyncio
 class TestDoctorDiagnosisIntegration:
     """医生诊断集成测试"""
 
@@ -482,28 +406,15 @@ class TestDoctorDiagnosisIntegration:
             "password": "password123"
         }
         login_response = await client.post("/api/v1/doctor/login", json=login_data)
-        access_token = login_response.json()["data"]["access_token"]
-        doctor_id = login_response.json()["data"]["doctor"]["doctor_id"]
+        login_payload = j(login_response)["data"]
+        access_token = login_payload["access_token"]
+        doctor_id = login_payload["doctor"]["doctor_id"]
 
         # 2. 创建患者和就诊记录
-        medical_record_data = {
-            "uuid": "550e8400-e29b-41d4-a716-446655440001",
-            "patient_phone": "13800138001",
-            "patient_info": {
-                "name": "张三",
-                "sex": "MALE",
-                "birthday": "1985-05-20",
-                "phone": "13800138001"
-            },
-            "pre_diagnosis": {
-                "uuid": "660e8400-e29b-41d4-a716-446655440001",
-                "height": 175.0,
-                "weight": 80.0
-            }
-        }
         record_response = await client.post(
             "/api/v1/medical-record",
-            json=medical_record_data
+            content=_RECORD_BYTES,
+            headers=JSON_HEADERS
         )
         assert record_response.status_code == 201
 
@@ -513,4 +424,4 @@ class TestDoctorDiagnosisIntegration:
             headers={"Authorization": f"Bearer {access_token}"}
         )
         assert doctor_info_response.status_code == 200
-        assert doctor_info_response.json()["data"]["doctor_id"] == doctor_id
+        assert j(doctor_info_response)["data"]["doctor_id"] == doctor_id
@@ -0,0 +1,26 @@
+"""
+健康检查与根路径测试
+"""
+import orjson
+
+from main import app
+from tests._asgi import asgi_call
+
+
+async def test_health_check():
+    """测试健康检查端点"""
+    status, body = await asgi_call(app, "GET", "/health")
+
+    assert status == 200
+    data = orjson.loads(body)
+    assert data["status"] == "healthy"
+
+
+async def test_root_endpoint():
+    """测试根端点"""
+    status, body = await asgi_call(app, "GET", "/")
+
+    assert status == 200
+    data = orjson.loads(body)
+    assert "message" in data
+    assert "version" in data
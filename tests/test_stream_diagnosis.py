@@ -3,135 +3,158 @@
 
 此脚本可以作为:
 1. pytest 单元测试运行: pytest tests/test_stream_diagnosis.py -v
-2. 独立脚本手动测试: python tests/test_stream_diagnosis.py
+2. 独立脚本手动测试: python tests/test_stream_diagnosis.py（或 python -m tests.test_stream_diagnosis）
 
 独立运行时需要:
 - 确保服务器已启动 (例如: uvicorn main:app --reload)
 - 设置正确的 BASE_URL 和认证信息
+- 设置环境变量 STREAM_TEST_CLIENT=aiohttp 可改用 aiohttp 读取流式响应（需自行安装 aiohttp）
 """
 import asyncio
-import json
-from unittest.mock import Mock, patch
+import os
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Mapping, Optional, Tuple
 
+if __name__ == "__main__":
+    # 作为独立脚本运行时把项目根目录加入 Python 路径，以便导入 tests 包
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import orjson
 import pytest
-from httpx import AsyncClient
+from httpx import AsyncClient, Timeout
+
+from tests._payloads import JSON_HEADERS, make_record, patient_phone, record_uuid
+from tests._utils import j
+
+
+# ========== SSE 解析 ==========
+
+async def _iter_sse_events(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[Optional[str], Optional[bytes]]]:
+    """
+    按整个事件解析 SSE 流，返回 (事件类型, data 字节)
+    直接在字节缓冲区里按空行切分，避免逐行解码和拼接
+    """
+    buf = bytearray()
+    async for chunk in chunks:
+        buf.extend(chunk)
+        idx = buf.find(b"\n\n")
+        while idx != -1:
+            raw = bytes(buf[:idx])
+            del buf[:idx + 2]
+
+            event_type = None
+            event_data = None
+            for line in raw.split(b"\n"):
+                if line.startswith(b"event: "):
+                    event_type = line[7:].decode()
+                elif line.startswith(b"data: "):
+                    event_data = line[6:]
+            yield event_type, event_data
+
+            idx = buf.find(b"\n\n")
 
 
 # ========== Pytest 单元测试 ==========
 
-@pytest.mark.asyncio
-async def test_stream_diagnosis_success(client: AsyncClient, auth_headers: dict):
+_RECORD_BYTES = orjson.dumps(make_record(
+    record_uuid(200),
+    patient_phone(200),
+    patient={"name": "流式诊断测试患者"},
+    weight=85.0,
+    coze_conversation_log="AI: 您好，请问您有什么不适？\nUser: 我最近感觉很疲劳。"
+))
+
+_DIAGNOSIS_BYTES = orjson.dumps({
+    "asr_text": "医生：您好，请问有什么不舒服？\n患者：我最近感觉很疲劳，浑身没力气。"
+})
+
+_SHORT_DIAGNOSIS_BYTES = orjson.dumps({"asr_text": "测试对话内容..."})
+
+# 模拟的流式诊断事件，模块加载时构建一次；接口按字符串匹配 complete 事件，所以保持 str
+_MOCK_STREAM_EVENTS: Tuple[str, ...] = (
+    'event: stage_start\ndata: {"stage": "medical_record", "stage_name": "生成病历", "step": "1/4"}\n\n',
+    'event: content\ndata: {"stage": "medical_record", "chunk": "主诉："}\n\n',
+    'event: content\ndata: {"stage": "medical_record", "chunk": "疲劳"}\n\n',
+    'event: stage_complete\ndata: {"stage": "medical_record", "stage_name": "生成病历", "result": "主诉：疲劳\\n病史：..."}\n\n',
+    'event: stage_start\ndata: {"stage": "diagnosis", "stage_name": "证型判断", "step": "2/4"}\n\n',
+    'event: content\ndata: {"stage": "diagnosis", "chunk": "脾虚"}\n\n',
+    'event: stage_complete\ndata: {"stage": "diagnosis", "stage_name": "证型判断", "result": "脾虚湿困型", "explanation": "患者疲劳..."}\n\n',
+    'event: stage_start\ndata: {"stage": "prescription", "stage_name": "处方生成", "step": "3/4"}\n\n',
+    'event: stage_complete\ndata: {"stage": "prescription", "stage_name": "处方生成", "result": "党参 10g..."}\n\n',
+    'event: stage_start\ndata: {"stage": "exercise_prescription", "stage_name": "运动处方生成", "step": "4/4"}\n\n',
+    'event: stage_complete\ndata: {"stage": "exercise_prescription", "stage_name": "运动处方生成", "result": "快走30分钟..."}\n\n',
+    'event: complete\ndata: {"status": "success", "total_processing_time": 10.5, "formatted_medical_record": "主诉：疲劳", "type_inference": "脾虚湿困型", "diagnosis_explanation": "患者疲劳...", "prescription": "党参 10g...", "exercise_prescription": "快走30分钟..."}\n\n',
+)
+
+
+async def _mock_stream_diagnosis(*args, **kwargs) -> AsyncIterator[str]:
+    """模拟流式诊断生成器"""
+    for event in _MOCK_STREAM_EVENTS:
+        yield event
+
+
+class _StubTCM:
+    """只实现流式诊断接口的 TCM 服务替身"""
+    __slots__ = ()
+
+    stream_complete_diagnosis = staticmethod(_mock_stream_diagnosis)
+
+
+@pytest.fixture
+def patched_tcm(monkeypatch: pytest.MonkeyPatch) -> _StubTCM:
+    """把患者接口使用的 TCM 诊断服务替换为流式替身"""
+    stub = _StubTCM()
+    monkeypatch.setattr("app.api.patient.get_tcm_service", lambda: stub)
+    return stub
+
+
+async def test_stream_diagnosis_success(
+        client: AsyncClient,
+        auth_headers: Mapping[str, str],
+        patched_tcm: _StubTCM
+):
     """测试流式AI诊断成功返回"""
     # 先创建就诊记录
-    record_data = {
-        "uuid": "550e8400-e29b-41d4-a716-446655440100",
-        "patient_phone": "13800138100",
-        "patient_info": {
-            "name": "流式诊断测试患者",
-            "sex": "MALE",
-            "birthday": "1985-01-01",
-            "phone": "13800138100"
-        },
-        "pre_diagnosis": {
-            "uuid": "660e8400-e29b-41d4-a716-446655440100",
-            "height": 175.0,
-            "weight": 85.0,
-            "coze_conversation_log": "AI: 您好，请问您有什么不适？\nUser: 我最近感觉很疲劳。"
-        }
-    }
-
-    create_response = await client.post("/api/v1/medical-record", json=record_data)
+    create_response = await client.post("/api/v1/medical-record", content=_RECORD_BYTES, headers=JSON_HEADERS)
     assert create_response.status_code == 201
-    record_id = create_response.json()["data"]["record_id"]
-
-    # Mock 流式诊断服务
-    async def mock_stream_diagnosis(*args, **kwargs):
-        """模拟流式诊断生成器"""
-        events = [
-            'event: stage_start\ndata: {"stage": "medical_record", "stage_name": "生成病历", "step": "1/4"}\n\n',
-            'event: content\ndata: {"stage": "medical_record", "chunk": "主诉："}\n\n',
-            'event: content\ndata: {"stage": "medical_record", "chunk": "疲劳"}\n\n',
-            'event: stage_complete\ndata: {"stage": "medical_record", "stage_name": "生成病历", "result": "主诉：疲劳\\n病史：..."}\n\n',
-            'event: stage_start\ndata: {"stage": "diagnosis", "stage_name": "证型判断", "step": "2/4"}\n\n',
-            'event: content\ndata: {"stage": "diagnosis", "chunk": "脾虚"}\n\n',
-            'event: stage_complete\ndata: {"stage": "diagnosis", "stage_name": "证型判断", "result": "脾虚湿困型", "explanation": "患者疲劳..."}\n\n',
-            'event: stage_start\ndata: {"stage": "prescription", "stage_name": "处方生成", "step": "3/4"}\n\n',
-            'event: stage_complete\ndata: {"stage": "prescription", "stage_name": "处方生成", "result": "党参 10g..."}\n\n',
-            'event: stage_start\ndata: {"stage": "exercise_prescription", "stage_name": "运动处方生成", "step": "4/4"}\n\n',
-            'event: stage_complete\ndata: {"stage": "exercise_prescription", "stage_name": "运动处方生成", "result": "快走30分钟..."}\n\n',
-            'event: complete\ndata: {"status": "success", "total_processing_time": 10.5, "formatted_medical_record": "主诉：疲劳", "type_inference": "脾虚湿困型", "diagnosis_explanation": "患者疲劳...", "prescription": "党参 10g...", "exercise_prescription": "快走30分钟..."}\n\n',
-        ]
-        for event in events:
-            yield event
-            await asyncio.sleep(0.01)
-
-    with patch('app.api.patient.get_tcm_service') as mock_service:
-        mock_instance = Mock()
-        mock_instance.stream_complete_diagnosis = mock_stream_diagnosis
-        mock_service.return_value = mock_instance
-
-        diagnosis_data = {
-            "asr_text": "医生：您好，请问有什么不舒服？\n患者：我最近感觉很疲劳，浑身没力气。"
-        }
-
-        # 发起流式请求
-        async with client.stream(
-                "POST",
-                f"/api/v1/medical-record/{record_id}/ai-diagnosis/stream",
-                json=diagnosis_data,
-                headers=auth_headers
-        ) as response:
-            assert response.status_code == 200
-            assert response.headers.get("content-type") == "text/event-stream; charset=utf-8"
-
-            # 收集所有事件
-            events = []
-            async for line in response.aiter_lines():
-                if line:
-                    events.append(line)
-
-            # 验证事件结构
-            assert len(events) > 0
-
-            # 解析事件
-            event_types = []
-            for i, line in enumerate(events):
-                if line.startswith("event: "):
-                    event_types.append(line[7:])
-
-            # 验证包含关键事件类型
-            assert "stage_start" in event_types
-            assert "content" in event_types
-            assert "stage_complete" in event_types
-            assert "complete" in event_types
-
-
-@pytest.mark.asyncio
-async def test_stream_diagnosis_record_not_found(client: AsyncClient, auth_headers: dict):
-    """测试流式诊断 - 就诊记录不存在"""
-    diagnosis_data = {
-        "asr_text": "测试对话内容..."
-    }
+    record_id = j(create_response)["data"]["record_id"]
 
+    # 发起流式请求
+    async with client.stream(
+            "POST",
+            f"/api/v1/medical-record/{record_id}/ai-diagnosis/stream",
+            content=_DIAGNOSIS_BYTES,
+            headers={**auth_headers, **JSON_HEADERS}
+    ) as response:
+        assert response.status_code == 200
+        assert response.headers.get("content-type") == "text/event-stream; charset=utf-8"
+
+        # 收集所有事件类型
+        event_types = {event_type async for event_type, _ in _iter_sse_events(response.aiter_bytes())}
+
+        # 验证包含关键事件类型
+        assert {"stage_start", "content", "stage_complete", "complete"} <= event_types
+
+
+async def test_stream_diagnosis_record_not_found(client: AsyncClient, auth_headers: Mapping[str, str]):
+    """测试流式诊断 - 就诊记录不存在"""
     response = await client.post(
         "/api/v1/medical-record/99999/ai-diagnosis/stream",
-        json=diagnosis_data,
-        headers=auth_headers
+        content=_SHORT_DIAGNOSIS_BYTES,
+        headers={**auth_headers, **JSON_HEADERS}
     )
 
     assert response.status_code == 404
 
 
-@pytest.mark.asyncio
 async def test_stream_diagnosis_unauthorized(client: AsyncClient):
     """测试流式诊断 - 未认证"""
-    diagnosis_data = {
-        "asr_text": "测试对话内容..."
-    }
-
     response = await client.post(
         "/api/v1/medical-record/1/ai-diagnosis/stream",
-        json=diagnosis_data
+        content=_SHORT_DIAGNOSIS_BYTES,
+        headers=JSON_HEADERS
     )
 
     assert response.status_code == 401
@@ -139,6 +162,101 @@ async def test_stream_diagnosis_unauthorized(client: AsyncClient):
 
 # ========== 独立脚本测试（手动测试用）==========
 
+# 配置超时：connect=10秒, read=300秒（流式响应需要较长的读取超时）, write=30秒
+_TIMEOUT = Timeout(
+    connect=10.0,
+    read=300.0,  # 读取超时设置长一些，因为LLM生成可能较慢
+    write=30.0,
+    pool=10.0
+)
+
+# 压测流式接口时可切换为 aiohttp，逐字节读取的开销比 httpx 小
+_USE_AIOHTTP = os.getenv("STREAM_TEST_CLIENT") == "aiohttp"
+
+
+@asynccontextmanager
+async def _open_stream(
+        client: AsyncClient,
+        path: str,
+        payload: dict,
+        headers: Mapping[str, str]
+) -> AsyncIterator[Tuple[int, AsyncIterator[bytes]]]:
+    """发起流式 POST 请求，返回 (状态码, 响应体字节流)"""
+    if not _USE_AIOHTTP:
+        async with client.stream("POST", path, json=payload, headers=headers) as response:
+            yield response.status_code, response.aiter_bytes()
+        return
+
+    import aiohttp
+
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=_TIMEOUT.connect,
+        sock_read=_TIMEOUT.read
+    )
+    async with aiohttp.ClientSession(base_url=str(client.base_url), timeout=timeout) as session:
+        async with session.post(path, json=payload, headers=headers) as resp:
+            yield resp.status, resp.content.iter_chunked(8192)
+
+
+def _on_stage_start(data: dict) -> None:
+    print(f"\n🔄 [{data.get('step', '')}] {data.get('stage_name', '')} 开始...\n", end="", flush=True)
+
+
+def _on_content(data: dict) -> None:
+    print(data.get("chunk", ""), end="", flush=True)
+
+
+def _on_stage_complete(data: dict) -> None:
+    text = f"\n✅ {data.get('stage_name', '')} 完成\n"
+    # 如果有提取的结果，显示
+    result = data.get("result")
+    if result and len(result) < 200:
+        text += f"   结果: {result[:100]}...\n"
+    print(text, end="", flush=True)
+
+
+def _on_complete(data: dict) -> None:
+    print(
+        "\n" + "=" * 60 + "\n"
+        "🎉 诊断完成!\n"
+        + "=" * 60 + "\n"
+        f"总耗时: {data.get('total_processing_time', 'N/A')}秒\n"
+        "\n📋 病历摘要:\n"
+        f"{data.get('formatted_medical_record', 'N/A')[:200]}...\n"
+        f"\n🔍 证型判断: {data.get('type_inference', 'N/A')}\n"
+        "\n💊 处方摘要:\n"
+        f"{data.get('prescription', 'N/A')[:200]}...\n"
+        "\n🏃 运动处方摘要:\n"
+        f"{data.get('exercise_prescription', 'N/A')[:200]}...\n",
+        end="",
+        flush=True
+    )
+
+
+def _on_saved(data: dict) -> None:
+    print(f"\n💾 诊断记录已保存，diagnosis_id: {data.get('diagnosis_id')}\n", end="", flush=True)
+
+
+def _on_error(data: dict) -> None:
+    print(f"\n❌ 错误: {data.get('message', '未知错误')}\n", end="", flush=True)
+
+
+def _on_save_error(data: dict) -> None:
+    print(f"\n⚠️ 保存失败: {data.get('message', '未知错误')}\n", end="", flush=True)
+
+
+# 按事件类型分发，每个事件只做一次字典查找
+_HANDLERS: Dict[str, Callable[[dict], None]] = {
+    "stage_start": _on_stage_start,
+    "content": _on_content,
+    "stage_complete": _on_stage_complete,
+    "complete": _on_complete,
+    "saved": _on_saved,
+    "error": _on_error,
+    "save_error": _on_save_error,
+}
+
+
 async def manual_test_stream_diagnosis():
     """
     手动测试流式诊断接口
@@ -147,8 +265,6 @@ async def manual_test_stream_diagnosis():
     1. 服务器已启动
     2. 修改下面的配置参数
     """
-    import httpx
-
     # ============ 配置参数 ============
     BASE_URL = "http://localhost:8001"  # 修改为你的服务器地址
 
@@ -170,14 +286,7 @@ async def manual_test_stream_diagnosis():
 患者：肢体有些困重，不太想动。"""
     # ============ 配置结束 ============
 
-    # 配置超时：connect=10秒, read=300秒（流式响应需要较长的读取超时）, write=30秒
-    timeout_config = httpx.Timeout(
-        connect=10.0,
-        read=300.0,  # 读取超时设置长一些，因为LLM生成可能较慢
-        write=30.0,
-        pool=10.0
-    )
-    async with httpx.AsyncClient(base_url=BASE_URL, timeout=timeout_config) as client:
+    async with AsyncClient(base_url=BASE_URL, timeout=_TIMEOUT) as client:
         print("=" * 60)
         print("流式AI诊断接口测试")
         print("=" * 60)
@@ -240,90 +349,33 @@ async def manual_test_stream_diagnosis():
 
         diagnosis_data = {"asr_text": ASR_TEXT}
 
-        current_stage = None
-        current_content = ""
-
-        async with client.stream(
-                "POST",
+        async with _open_stream(
+                client,
                 f"/api/v1/medical-record/{record_id}/ai-diagnosis/stream",
-                json=diagnosis_data,
-                headers=auth_headers
-        ) as response:
-            if response.status_code != 200:
-                print(f"❌ 请求失败: {response.status_code}")
-                content = await response.aread()
+                diagnosis_data,
+                auth_headers
+        ) as (status_code, chunks):
+            if status_code != 200:
+                print(f"❌ 请求失败: {status_code}")
+                content = b"".join([chunk async for chunk in chunks])
                 print(content.decode())
                 return
 
             print("✅ 连接成功，开始接收流式数据...\n")
 
-            event_type = None
-            event_data = None
+            async for event_type, event_data in _iter_sse_events(chunks):
+                if not (event_type and event_data):
+                    continue
 
-            async for line in response.aiter_lines():
-                line = line.strip()
-                if not line:
-                    # 空行表示事件结束，处理事件
-                    if event_type and event_data:
-                        try:
-                            data = json.loads(event_data)
-
-                            if event_type == "stage_start":
-                                stage_name = data.get("stage_name", "")
-                                step = data.get("step", "")
-                                print(f"\n🔄 [{step}] {stage_name} 开始...")
-                                current_stage = data.get("stage")
-                                current_content = ""
-
-                            elif event_type == "content":
-                                chunk = data.get("chunk", "")
-                                print(chunk, end="", flush=True)
-                                current_content += chunk
-
-                            elif event_type == "stage_complete":
-                                stage_name = data.get("stage_name", "")
-                                print(f"\n✅ {stage_name} 完成")
-
-                                # 如果有提取的结果，显示
-                                result = data.get("result")
-                                if result and len(result) < 200:
-                                    print(f"   结果: {result[:100]}...")
-
-                            elif event_type == "complete":
-                                print("\n" + "=" * 60)
-                                print("🎉 诊断完成!")
-                                print("=" * 60)
-                                print(f"总耗时: {data.get('total_processing_time', 'N/A')}秒")
-                                print(f"\n📋 病历摘要:")
-                                print(data.get('formatted_medical_record', 'N/A')[:200] + "...")
-                                print(f"\n🔍 证型判断: {data.get('type_inference', 'N/A')}")
-                                print(f"\n💊 处方摘要:")
-                                print(data.get('prescription', 'N/A')[:200] + "...")
-                                print(f"\n🏃 运动处方摘要:")
-                                print(data.get('exercise_prescription', 'N/A')[:200] + "...")
-
-                            elif event_type == "saved":
-                                diagnosis_id = data.get("diagnosis_id")
-                                print(f"\n💾 诊断记录已保存，diagnosis_id: {diagnosis_id}")
-
-                            elif event_type == "error":
-                                print(f"\n❌ 错误: {data.get('message', '未知错误')}")
-
-                            elif event_type == "save_error":
-                                print(f"\n⚠️ 保存失败: {data.get('message', '未知错误')}")
-
-                        except json.JSONDecodeError as e:
-                            print(f"JSON解析错误: {e}")
-
-                    # 重置
-                    event_type = None
-                    event_data = None
+                try:
+                    data = orjson.loads(event_data)
+                except orjson.JSONDecodeError as e:
+                    print(f"JSON解析错误: {e}")
                     continue
 
-                if line.startswith("event: "):
-                    event_type = line[7:]
-                elif line.startswith("data: "):
-                    event_data = line[6:]
+                handler = _HANDLERS.get(event_type)
+                if handler:
+                    handler(data)
 
         print("\n" + "=" * 60)
         print("测试完成!")